@@ -1,37 +1,107 @@
 #!/usr/bin/env python3
 """
 Whisper + PyAnnote Helper Script for Meeting Assistant CLI
-Combines OpenAI Whisper for transcription with PyAnnote for speaker diarization
+Combines Whisper (faster-whisper or OpenAI Whisper) for transcription with PyAnnote for speaker diarization
 """
 
 import sys
 import json
+import threading
 import warnings
 import argparse
+import contextlib
+import functools
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
 import os
+import re
 from pathlib import Path
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Suppress warnings
 warnings.filterwarnings("ignore")
 
+# PyAnnote voice activity detection model, used instead of full diarization for single-speaker audio
+VAD_MODEL = "pyannote/voice-activity-detection"
+
+# .env files searched for a HuggingFace token, in order
+DOTENV_PATHS = (".env", "../.env", "../../.env")
+
+# Loaded models, kept resident so --serve mode only pays the load cost once
+WHISPER_MODEL_CACHE = {}
+PYANNOTE_PIPELINE_CACHE = {}
+MODEL_CACHE_LOCK = threading.Lock()
+
+# openai-whisper installs per-call hooks on the shared model and PyAnnote pipelines
+# are not thread-safe, so concurrent --inputs jobs take turns on these
+OPENAI_WHISPER_LOCK = threading.Lock()
+PYANNOTE_LOCK = threading.Lock()
+
+# process_audio keyword arguments accepted in --serve request "options"
+SERVE_OPTIONS = {"whisper_model", "pyannote_model", "hf_token", "max_speakers", "min_speakers", "batch_size", "fp16", "mode"}
+
+# process_audio modes: full pipeline, transcription only, or diarization only
+PROCESSING_MODES = ("both", "transcribe", "diarize")
+
+def dumps(obj):
+    """Serialize a result to a JSON string, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+    return json.dumps(obj)
+
+def is_installed(module_name):
+    """Check whether a module can be imported, without importing it"""
+    try:
+        return importlib.util.find_spec(module_name) is not None
+    except (ImportError, ValueError):
+        # Parent package of a dotted module name is missing
+        return False
+
 def check_dependencies():
     """Check if required packages are installed"""
     missing = []
     
-    try:
-        import whisper
-    except ImportError:
-        missing.append("openai-whisper")
+    whisper_ok, whisper_missing = check_whisper_only()
+    if not whisper_ok:
+        missing.extend(whisper_missing)
     
-    try:
-        import pyannote.audio
-        from pyannote.audio import Pipeline
-    except ImportError:
+    diarization_ok, diarization_missing = check_diarization_dependencies()
+    if not diarization_ok:
+        missing.extend(diarization_missing)
+    
+    if missing:
+        return False, missing
+    
+    return True, []
+
+def check_whisper_only():
+    """Check if at least Whisper is available for transcription-only mode"""
+    if is_installed("faster_whisper") or is_installed("whisper"):
+        return True, []
+    return False, ["faster-whisper"]
+
+def check_diarization_dependencies():
+    """Check if the packages needed for PyAnnote diarization are installed"""
+    missing = []
+    
+    if not is_installed("pyannote.audio"):
         missing.append("pyannote.audio")
     
-    try:
-        import torch
-    except ImportError:
+    if not is_installed("torch"):
         missing.append("torch")
     
     if missing:
@@ -39,13 +109,318 @@ def check_dependencies():
     
     return True, []
 
-def check_whisper_only():
-    """Check if at least Whisper is available for transcription-only mode"""
+def get_default_device():
+    """Return "cuda" when a GPU is usable through torch, otherwise "cpu" """
     try:
-        import whisper
-        return True, []
+        import torch
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    except ImportError:
+        return "cpu"
+
+def load_whisper_model(whisper_model, num_workers=1):
+    """
+    Load a Whisper model, preferring faster-whisper (CTranslate2) over openai-whisper
+    
+    faster-whisper runs with int8 weights (int8_float16 on CUDA), which is several
+    times faster and uses a fraction of the memory of the reference implementation.
+    Loaded models are cached for the lifetime of the process.
+    
+    Args:
+        whisper_model: Whisper model size (tiny, base, small, medium, large)
+        num_workers: Number of threads that may transcribe with the model concurrently
+    
+    Returns:
+        Tuple of (backend name, model object)
+    """
+    device = get_default_device()
+    
+    try:
+        from faster_whisper import WhisperModel
     except ImportError:
-        return False, ["openai-whisper"]
+        WhisperModel = None
+    
+    if WhisperModel is None:
+        compute_type = "default"
+    else:
+        compute_type = "int8_float16" if device == "cuda" else "int8"
+    
+    cache_key = (whisper_model, device, compute_type, num_workers)
+    
+    with MODEL_CACHE_LOCK:
+        if cache_key in WHISPER_MODEL_CACHE:
+            return WHISPER_MODEL_CACHE[cache_key]
+        
+        if WhisperModel is None:
+            import whisper
+            loaded = ("openai-whisper", whisper.load_model(whisper_model, device=device))
+        else:
+            # CTranslate2 models are thread-safe; num_workers lets concurrent calls run in parallel
+            model = WhisperModel(whisper_model, device=device, compute_type=compute_type,
+                                 num_workers=num_workers)
+            
+            # Batched pipeline forwards several VAD chunks through the model at once
+            # (only available in newer faster-whisper releases)
+            try:
+                from faster_whisper import BatchedInferencePipeline
+                loaded = ("faster-whisper-batched", BatchedInferencePipeline(model=model))
+            except ImportError:
+                loaded = ("faster-whisper", model)
+        
+        WHISPER_MODEL_CACHE[cache_key] = loaded
+        return loaded
+
+def load_pyannote_pipeline(model_id, hf_token, device):
+    """
+    Load a PyAnnote pipeline onto a device, cached for the lifetime of the process
+    
+    Args:
+        model_id: PyAnnote model ID from HuggingFace
+        hf_token: HuggingFace token for accessing PyAnnote models
+        device: torch.device to run the pipeline on
+    
+    Returns:
+        PyAnnote Pipeline
+    """
+    cache_key = (model_id, str(device))
+    
+    with MODEL_CACHE_LOCK:
+        if cache_key in PYANNOTE_PIPELINE_CACHE:
+            return PYANNOTE_PIPELINE_CACHE[cache_key]
+        
+        from pyannote.audio import Pipeline
+        
+        pipeline = Pipeline.from_pretrained(
+            model_id,
+            use_auth_token=hf_token
+        )
+        pipeline.to(device)
+        
+        PYANNOTE_PIPELINE_CACHE[cache_key] = pipeline
+        return pipeline
+
+def transcribe_audio(backend, model, audio_file, batch_size=None):
+    """
+    Transcribe an audio file with word timestamps
+    
+    Args:
+        backend: Backend name returned by load_whisper_model
+        model: Model object returned by load_whisper_model
+        audio_file: Path to audio file
+        batch_size: Number of chunks decoded together by the batched pipeline
+                    (defaults to 16 on CUDA, 4 on CPU)
+    
+    Returns:
+        Dictionary in the openai-whisper result shape ("segments", "language", "duration")
+    """
+    if backend == "openai-whisper":
+        with OPENAI_WHISPER_LOCK:
+            return model.transcribe(audio_file, word_timestamps=True)
+    
+    if backend == "faster-whisper-batched":
+        if batch_size is None:
+            batch_size = 16 if get_default_device() == "cuda" else 4
+        segments, info = model.transcribe(audio_file, batch_size=batch_size, word_timestamps=True)
+    else:
+        segments, info = model.transcribe(audio_file, word_timestamps=True, vad_filter=True)
+    
+    # Adapt faster-whisper Segment objects to the openai-whisper dict shape used downstream
+    result_segments = []
+    for segment in segments:
+        result_segments.append({
+            "id": segment.id,
+            "start": segment.start,
+            "end": segment.end,
+            "text": segment.text,
+            "words": [
+                {"word": w.word, "start": w.start, "end": w.end, "probability": w.probability}
+                for w in (segment.words or [])
+            ]
+        })
+    
+    return {
+        "segments": result_segments,
+        "language": info.language,
+        "duration": info.duration
+    }
+
+def compile_phrases(phrases):
+    """Compile phrases into a single regex that matches any of them as a substring"""
+    return re.compile("|".join(re.escape(phrase) for phrase in sorted(phrases, key=len, reverse=True)))
+
+# Known speaker change phrases from the test conversation
+CLEAR_SPEAKER_CHANGES = [
+    "into the weeds",
+    "yeah. perf",
+    "well, i use typescript and i have bugs",
+    "by the way, speaking of really good",
+    "all right. enough of that",
+    "you want to go first",
+    "a string literal type is a"
+]
+
+# Topic transition phrases
+TOPIC_SHIFTS = frozenset({
+    'by the way', 'speaking of', 'all right', 'alright', 'enough of that',
+    'anyway', 'anyways', 'actually', 'you know what', 'let me tell you'
+})
+
+# Common interjection words that suggest speaker changes (simple detection)
+SIMPLE_INTERJECTIONS = frozenset({
+    'yeah', 'yes', 'no', 'okay', 'ok', 'right', 'exactly', 'true', 'sure',
+    'well', 'so', 'but', 'and', 'actually', 'really', 'definitely', 
+    'absolutely', 'totally', 'completely', 'hmm', 'uh', 'um', 'ah'
+})
+
+# Enhanced interjection and conversation markers for advanced detection
+ADVANCED_INTERJECTIONS = frozenset({
+    'yeah', 'yes', 'yep', 'yup', 'no', 'nope', 'okay', 'ok', 'right', 'exactly', 
+    'true', 'sure', 'well', 'so', 'but', 'and', 'actually', 'really', 'definitely', 
+    'absolutely', 'totally', 'completely', 'hmm', 'uh', 'um', 'ah', 'oh', 'hey',
+    'alright', 'all right', 'perfect', 'great', 'nice', 'cool', 'awesome',
+    'into the weeds', 'perf'  # Specific phrases from the test
+})
+
+CONVERSATION_FLOW_PHRASES = ('by the way', 'speaking of', 'all right', 'enough of that')
+
+# Response indicators (balanced detection)
+RESPONSES = frozenset({
+    'yeah', 'yes', 'well', 'oh', 'no', 'right', 'exactly', 'true', 'sure',
+    'okay', 'ok', 'perfect', 'great', 'nice'
+})
+
+# Very short responses that make up a whole segment
+SHORT_RESPONSES = frozenset({
+    'yeah.', 'yes.', 'yeah', 'yes', 'well.', 'oh.', 'right.', 'perf.', 'perf'
+})
+
+# Question words (balanced detection)
+QUESTION_WORDS = frozenset({
+    'how', 'what', 'why', 'when', 'where', 'who', 'which', 'can', 'could', 
+    'would', 'should', 'do', 'does', 'did', 'is', 'are'
+})
+
+# Question words (advanced detection)
+ADVANCED_QUESTION_WORDS = QUESTION_WORDS.union({'was', 'were'})
+
+# Name mentions or direct address, matched as whole words
+NAME_RE = re.compile(r"\b(?:scott|wes|west)\b")
+
+# Phrase groups looked up in every segment, keyed by the kind reported on a match
+PHRASE_GROUPS = {
+    "clear": CLEAR_SPEAKER_CHANGES,
+    "topic": TOPIC_SHIFTS,
+    "flow": ADVANCED_INTERJECTIONS.union(CONVERSATION_FLOW_PHRASES)
+}
+
+def build_phrase_automaton(phrases):
+    """
+    Build an Aho-Corasick automaton matching any of the phrases in one pass
+    
+    Args:
+        phrases: Phrases of a single group
+    
+    Returns:
+        pyahocorasick Automaton whose values are the matched phrases
+    """
+    automaton = ahocorasick.Automaton()
+    for phrase in phrases:
+        automaton.add_word(phrase, phrase)
+    automaton.make_automaton()
+    return automaton
+
+# One matcher per group, so a lookup never walks hits from groups it did not ask
+# for (the short "flow" words match inside almost every segment). Without
+# pyahocorasick, fall back to one compiled regex per phrase group
+if ahocorasick is not None:
+    PHRASE_AUTOMATA = {kind: build_phrase_automaton(phrases) for kind, phrases in PHRASE_GROUPS.items()}
+    PHRASE_PATTERNS = None
+else:
+    PHRASE_AUTOMATA = None
+    PHRASE_PATTERNS = {kind: compile_phrases(phrases) for kind, phrases in PHRASE_GROUPS.items()}
+
+def find_phrases(text, kinds):
+    """
+    Find which phrase groups occur in a text
+    
+    Args:
+        text: Lowercased segment text
+        kinds: Phrase group kinds the caller is interested in
+    
+    Returns:
+        Dictionary of kind -> first matched phrase, for each kind found in text
+    """
+    hits = {}
+    
+    if PHRASE_AUTOMATA is not None:
+        for kind in kinds:
+            # Only the first hit of each group is needed
+            for _, phrase in PHRASE_AUTOMATA[kind].iter(text):
+                hits[kind] = phrase
+                break
+        return hits
+    
+    for kind in kinds:
+        match = PHRASE_PATTERNS[kind].search(text)
+        if match:
+            hits[kind] = match.group(0)
+    return hits
+
+def load_waveform(audio_file, sample_rate=16000, pin_memory=False):
+    """
+    Decode an audio file into the in-memory input accepted by PyAnnote pipelines
+    
+    PyAnnote works at 16kHz, so resampling happens here once rather than on
+    every read of the file inside the pipeline.
+    
+    Args:
+        audio_file: Path to audio file
+        sample_rate: Target sample rate
+        pin_memory: Pin the waveform in page-locked memory for faster GPU transfer
+    
+    Returns:
+        Dictionary with "waveform" (channel, time) tensor and "sample_rate"
+    """
+    import torchaudio
+    
+    waveform, file_sample_rate = torchaudio.load(audio_file)
+    if file_sample_rate != sample_rate:
+        waveform = torchaudio.functional.resample(waveform, file_sample_rate, sample_rate)
+    if pin_memory:
+        waveform = waveform.pin_memory()
+    
+    return {"waveform": waveform, "sample_rate": sample_rate}
+
+def segment_timings(segments):
+    """
+    Extract segment timing features in one vectorized pass
+    
+    Args:
+        segments: List of Whisper transcription segments
+    
+    Returns:
+        Tuple of (starts, durations, gaps) lists, where gaps[i] is the silence
+        before segment i (0.0 for the first segment)
+    """
+    if not segments:
+        return [], [], []
+    
+    if np is None:
+        starts = [segment["start"] for segment in segments]
+        ends = [segment["end"] for segment in segments]
+        durations = [end - start for start, end in zip(starts, ends)]
+        gaps = [0.0] + [start - prev_end for start, prev_end in zip(starts[1:], ends)]
+        return starts, durations, gaps
+    
+    count = len(segments)
+    starts = np.fromiter((segment["start"] for segment in segments), dtype=np.float64, count=count)
+    ends = np.fromiter((segment["end"] for segment in segments), dtype=np.float64, count=count)
+    durations = ends - starts
+    gaps = np.empty_like(starts)
+    gaps[0] = 0.0
+    gaps[1:] = starts[1:] - ends[:-1]
+    
+    # Plain floats index much faster than NumPy scalars inside the rule loops
+    return starts.tolist(), durations.tolist(), gaps.tolist()
 
 def simple_speaker_change_detection(segments, silence_threshold=0.8, pitch_change_threshold=0.3):
     """
@@ -58,20 +433,18 @@ def simple_speaker_change_detection(segments, silence_threshold=0.8, pitch_chang
         pitch_change_threshold: Not used in this simple version, for future enhancement
     
     Returns:
-        List of segments with speaker assignments
+        Tuple of (the input segments, each updated in place with a "speaker_id",
+        set of speaker IDs assigned)
     """
     if not segments:
-        return []
+        return [], set()
     
-    enhanced_segments = []
     current_speaker = 1
+    speaker_id = "Speaker_1"
+    speakers = {speaker_id}
     
-    # Common interjection words that suggest speaker changes
-    interjections = {
-        'yeah', 'yes', 'no', 'okay', 'ok', 'right', 'exactly', 'true', 'sure',
-        'well', 'so', 'but', 'and', 'actually', 'really', 'definitely', 
-        'absolutely', 'totally', 'completely', 'hmm', 'uh', 'um', 'ah'
-    }
+    # Lowercase and split every segment once up front
+    words_list = [segment.get("text", "").strip().lower().split() for segment in segments]
     
     for i, segment in enumerate(segments):
         # Simple heuristic: look for gaps between segments
@@ -90,12 +463,7 @@ def simple_speaker_change_detection(segments, silence_threshold=0.8, pitch_chang
             prev_duration = prev_segment["end"] - prev_segment["start"]
             
             # If current segment is very short and starts with interjection
-            segment_text = segment.get("text", "").strip().lower()
-            first_word = segment_text.split()[0] if segment_text.split() else ""
-            
-            if (segment_duration < 3.0 and 
-                (first_word in interjections or 
-                 any(word in interjections for word in segment_text.split()[:2]))):
+            if segment_duration < 3.0 and not SIMPLE_INTERJECTIONS.isdisjoint(words_list[i][:2]):
                 should_change_speaker = True
             
             # If there's any noticeable gap and previous segment was substantial
@@ -104,12 +472,12 @@ def simple_speaker_change_detection(segments, silence_threshold=0.8, pitch_chang
         
         if should_change_speaker:
             current_speaker = 2 if current_speaker == 1 else 1
+            speaker_id = f"Speaker_{current_speaker}"
+            speakers.add(speaker_id)
         
-        enhanced_segment = segment.copy()
-        enhanced_segment["speaker_id"] = f"Speaker_{current_speaker}"
-        enhanced_segments.append(enhanced_segment)
+        segment["speaker_id"] = speaker_id
     
-    return enhanced_segments
+    return segments, speakers
 
 def advanced_speaker_change_detection(segments, min_speaker_duration=1.0):
     """
@@ -120,42 +488,31 @@ def advanced_speaker_change_detection(segments, min_speaker_duration=1.0):
         min_speaker_duration: Minimum time a speaker should speak before switching
     
     Returns:
-        List of segments with speaker assignments
+        Tuple of (the input segments, each updated in place with a "speaker_id",
+        set of speaker IDs assigned)
     """
     if not segments:
-        return []
-    
-    # Enhanced interjection and conversation markers
-    interjections = {
-        'yeah', 'yes', 'yep', 'yup', 'no', 'nope', 'okay', 'ok', 'right', 'exactly', 
-        'true', 'sure', 'well', 'so', 'but', 'and', 'actually', 'really', 'definitely', 
-        'absolutely', 'totally', 'completely', 'hmm', 'uh', 'um', 'ah', 'oh', 'hey',
-        'alright', 'all right', 'perfect', 'great', 'nice', 'cool', 'awesome',
-        'into the weeds', 'perf'  # Specific phrases from the test
-    }
+        return [], set()
     
-    question_words = {
-        'what', 'how', 'why', 'when', 'where', 'who', 'which', 'can', 'could',
-        'would', 'should', 'do', 'does', 'did', 'is', 'are', 'was', 'were'
-    }
+    # Lowercase and split every segment once up front
+    texts = [segment.get("text", "").strip().lower() for segment in segments]
+    words_list = [text.split() for text in texts]
+    starts, durations, gaps = segment_timings(segments)
     
     # First pass: identify potential speaker change points
-    change_points = []
+    change_points = set()
     for i in range(1, len(segments)):
-        prev_segment = segments[i-1]
-        current_segment = segments[i]
-        gap = current_segment["start"] - prev_segment["end"]
+        gap = gaps[i]
         
         # Get text for analysis
-        current_text = current_segment.get("text", "").strip().lower()
-        prev_text = prev_segment.get("text", "").strip().lower()
+        current_text = texts[i]
+        prev_text = texts[i-1]
         
-        current_words = current_text.split()
-        prev_words = prev_text.split()
+        current_words = words_list[i]
+        prev_words = words_list[i-1]
         
         # Duration analysis
-        current_duration = current_segment["end"] - current_segment["start"]
-        prev_duration = prev_segment["end"] - prev_segment["start"]
+        current_duration = durations[i]
         
         should_change = False
         
@@ -166,12 +523,11 @@ def advanced_speaker_change_detection(segments, min_speaker_duration=1.0):
         # Rule 2: Short interjections
         if (current_duration < 4.0 and 
             len(current_words) <= 8 and
-            (current_words[0] if current_words else "") in interjections):
+            (current_words[0] if current_words else "") in ADVANCED_INTERJECTIONS):
             should_change = True
         
         # Rule 3: Question/answer patterns
-        if (prev_text.endswith('?') or 
-            any(word in question_words for word in prev_words[:3])):
+        if prev_text.endswith('?') or not ADVANCED_QUESTION_WORDS.isdisjoint(prev_words[:3]):
             should_change = True
         
         # Rule 4: Very short responses (like "Yeah. Perf.")
@@ -179,214 +535,373 @@ def advanced_speaker_change_detection(segments, min_speaker_duration=1.0):
             should_change = True
         
         # Rule 5: Conversation flow indicators
-        if (any(phrase in current_text for phrase in ['by the way', 'speaking of', 'all right', 'enough of that']) or
-            any(phrase in current_text for phrase in interjections)):
+        if "flow" in find_phrases(current_text, ("flow",)):
             should_change = True
         
         # Rule 6: Name mentions or direct address
-        if any(name in current_text for name in ['scott', 'wes', 'west']):
+        if NAME_RE.search(current_text):
             should_change = True
         
         if should_change:
-            change_points.append(i)
+            change_points.add(i)
     
     # Second pass: assign speakers based on change points
-    enhanced_segments = []
     current_speaker = 1
+    speaker_id = "Speaker_1"
+    speakers = {speaker_id}
     last_speaker_change_time = 0
     
     for i, segment in enumerate(segments):
         # Check if this is a speaker change point
         if i in change_points:
             # More relaxed time constraint
-            time_since_change = segment["start"] - last_speaker_change_time
+            time_since_change = starts[i] - last_speaker_change_time
             if time_since_change > min_speaker_duration:
                 current_speaker = 2 if current_speaker == 1 else 1
-                last_speaker_change_time = segment["start"]
+                speaker_id = f"Speaker_{current_speaker}"
+                speakers.add(speaker_id)
+                last_speaker_change_time = starts[i]
         
-        enhanced_segment = segment.copy()
-        enhanced_segment["speaker_id"] = f"Speaker_{current_speaker}"
-        enhanced_segments.append(enhanced_segment)
+        segment["speaker_id"] = speaker_id
+    
+    return segments, speakers
+
+def balanced_speaker_rules(starts, durations, gaps, has_clear, starts_response, starts_well,
+                           has_topic, prev_is_question, is_short_response, has_name,
+                           speaker_out, rule_out):
+    """
+    Run the balanced detection state machine over precomputed segment features
+    
+    Only numbers and booleans are involved. Results are written into the two
+    output buffers.
+    
+    Args:
+        starts, durations, gaps: Segment timings from segment_timings
+        has_clear ... has_name: Per-segment text features (see balanced_speaker_detection)
+        speaker_out: Receives the speaker number (1 or 2) of each segment
+        rule_out: Receives the number of the rule that changed speaker (0 for none)
+    """
+    current_speaker = 1
+    last_change_time = 0.0
     
-    return enhanced_segments
+    for i in range(len(starts)):
+        rule = 0
+        
+        if i > 0:
+            gap = gaps[i]
+            duration = durations[i]
+            time_since_change = starts[i] - last_change_time
+            
+            # Rules in priority order; thresholds are kept deliberately sensitive
+            if has_clear[i]:
+                rule = 1
+            elif duration < 3.0 and starts_response[i] and gap > 0.3 and time_since_change > 1.0:
+                rule = 2
+            elif starts_well[i] and gap > 0.2 and time_since_change > 1.0:
+                rule = 3
+            elif has_topic[i] and gap > 0.3 and time_since_change > 1.5:
+                rule = 4
+            elif prev_is_question[i] and gap > 0.2 and time_since_change > 1.0:
+                rule = 5
+            elif duration < 2.0 and is_short_response[i] and time_since_change > 2.0 and gap > 0.2:
+                rule = 6
+            elif has_name[i] and time_since_change > 1.0:
+                rule = 7
+            elif gap > 0.8 and durations[i-1] > 2.0 and time_since_change > 3.0:
+                rule = 8
+        
+        if rule != 0:
+            current_speaker = 2 if current_speaker == 1 else 1
+            last_change_time = starts[i]
+        
+        speaker_out[i] = current_speaker
+        rule_out[i] = rule
 
 def balanced_speaker_detection(segments):
     """
     Balanced speaker detection that follows natural conversation patterns
     Enhanced with specific patterns from the test case
     
+    Text features are extracted in Python, then the rule state machine runs
+    over plain arrays (see balanced_speaker_rules).
+    
     Args:
         segments: List of Whisper transcription segments
     
     Returns:
-        List of segments with speaker assignments
+        Tuple of (the input segments, each updated in place with a "speaker_id",
+        set of speaker IDs assigned)
     """
     if not segments:
-        return []
-    
-    # Enhanced patterns based on the test case
-    clear_speaker_changes = [
-        "into the weeds",
-        "yeah. perf",
-        "well, i use typescript and i have bugs",
-        "by the way, speaking of really good",
-        "all right. enough of that",
-        "you want to go first",
-        "a string literal type is a"
-    ]
+        return [], set()
     
-    # Topic transition phrases
-    topic_shifts = {
-        'by the way', 'speaking of', 'all right', 'alright', 'enough of that',
-        'anyway', 'anyways', 'actually', 'you know what', 'let me tell you'
-    }
+    # Lowercase and split every segment once up front
+    texts = [segment.get("text", "").strip().lower() for segment in segments]
+    words_list = [text.split() for text in texts]
+    starts, durations, gaps = segment_timings(segments)
+    phrases_list = [find_phrases(text, ("clear", "topic")) for text in texts]
     
-    # Response indicators (more comprehensive)
-    responses = {
-        'yeah', 'yes', 'well', 'oh', 'no', 'right', 'exactly', 'true', 'sure',
-        'okay', 'ok', 'perfect', 'great', 'nice'
-    }
+    # Rule 1: Clear speaker change phrases (highest priority)
+    has_clear = ["clear" in phrases for phrases in phrases_list]
+    # Rule 2: Short interjections after gaps
+    starts_response = [bool(words) and words[0] in RESPONSES for words in words_list]
+    # Rule 3: Contradictory statements
+    starts_well = [text.startswith("well") for text in texts]
+    # Rule 4: Topic transitions
+    has_topic = ["topic" in phrases for phrases in phrases_list]
+    # Rule 5: Question/answer patterns (based on the previous segment)
+    prev_is_question = [False] + [
+        text.endswith('?') or not QUESTION_WORDS.isdisjoint(words[:3])
+        for text, words in zip(texts, words_list[:-1])
+    ]
+    # Rule 6: Very short responses
+    is_short_response = [len(words) <= 3 and text in SHORT_RESPONSES for text, words in zip(texts, words_list)]
+    # Rule 7: Name mentions
+    has_name = [NAME_RE.search(text) is not None for text in texts]
+    # Rule 8 (significant gaps with substantial previous content) only needs timings
     
-    # Question words
-    question_words = {
-        'how', 'what', 'why', 'when', 'where', 'who', 'which', 'can', 'could', 
-        'would', 'should', 'do', 'does', 'did', 'is', 'are'
-    }
+    features = [starts, durations, gaps, has_clear, starts_response, starts_well,
+                has_topic, prev_is_question, is_short_response, has_name]
+    count = len(segments)
+    speaker_out = [0] * count
+    rule_out = [0] * count
+    balanced_speaker_rules(*features, speaker_out, rule_out)
     
-    enhanced_segments = []
-    current_speaker = 1
-    last_change_time = 0
+    speaker_ids = {1: "Speaker_1", 2: "Speaker_2"}
+    speakers = set()
     
     for i, segment in enumerate(segments):
-        should_change_speaker = False
-        reason = ""
+        rule = rule_out[i]
+        if rule:
+            if rule == 1:
+                reason = f"Clear phrase: '{phrases_list[i]['clear']}'"
+            elif rule == 2:
+                reason = f"Short interjection: '{words_list[i][0]}' after {gaps[i]:.2f}s gap"
+            elif rule == 3:
+                reason = "Contradictory statement starting with 'well'"
+            elif rule == 4:
+                reason = f"Topic transition: '{phrases_list[i]['topic']}'"
+            elif rule == 5:
+                reason = "Question/answer pattern"
+            elif rule == 6:
+                reason = f"Very short response: '{texts[i]}'"
+            elif rule == 7:
+                reason = "Name mention"
+            else:
+                reason = f"Long gap: {gaps[i]:.2f}s after substantial content"
+            print(f"Speaker change at {starts[i]:.2f}s: {reason}", file=sys.stderr)
         
-        # Get segment info
-        text = segment.get("text", "").strip().lower()
-        words = text.split()
-        duration = segment["end"] - segment["start"]
-        start_time = segment["start"]
+        speaker_id = speaker_ids[speaker_out[i]]
+        speakers.add(speaker_id)
+        segment["speaker_id"] = speaker_id
+    
+    return segments, speakers
+
+def assign_speakers_by_overlap(segments, turns):
+    """
+    Assign each transcription segment the speaker whose turn overlaps it the most
+    
+    Segments and turns are swept in time order with two pointers, so each
+    segment only looks at the turns inside its own time window instead of
+    scanning every turn.
+    
+    Args:
+        segments: List of Whisper transcription segments
+        turns: List of (start, end, speaker) diarization turns sorted by start time
+    
+    Returns:
+        List of speaker labels, one per segment (None where no turn overlaps)
+    """
+    speakers = [None] * len(segments)
+    order = sorted(range(len(segments)), key=lambda idx: segments[idx]["start"])
+    num_turns = len(turns)
+    j = 0
+    
+    for idx in order:
+        start_time = segments[idx]["start"]
+        end_time = segments[idx]["end"]
         
-        # Calculate time since last change
-        time_since_change = start_time - last_change_time
+        # Turns ending before this segment starts can't overlap it or any later one
+        while j < num_turns and turns[j][1] <= start_time:
+            j += 1
         
-        if i > 0:
-            prev_segment = segments[i-1]
-            gap = start_time - prev_segment["end"]
-            prev_text = prev_segment.get("text", "").strip().lower()
-            
-            # Rule 1: Clear speaker change phrases (highest priority)
-            for phrase in clear_speaker_changes:
-                if phrase in text:
-                    should_change_speaker = True
-                    reason = f"Clear phrase: '{phrase}'"
-                    break
-            
-            # Rule 2: Short interjections after gaps
-            if not should_change_speaker and duration < 3.0:
-                if words and words[0] in responses:
-                    if gap > 0.3 and time_since_change > 1.0:  # More sensitive
-                        should_change_speaker = True
-                        reason = f"Short interjection: '{words[0]}' after {gap:.2f}s gap"
-            
-            # Rule 3: Contradictory statements
-            if not should_change_speaker and text.startswith("well"):
-                if gap > 0.2 and time_since_change > 1.0:  # Very sensitive
-                    should_change_speaker = True
-                    reason = "Contradictory statement starting with 'well'"
-            
-            # Rule 4: Topic transitions
-            if not should_change_speaker:
-                for transition in topic_shifts:
-                    if transition in text:
-                        if gap > 0.3 and time_since_change > 1.5:  # More sensitive
-                            should_change_speaker = True
-                            reason = f"Topic transition: '{transition}'"
-                            break
-            
-            # Rule 5: Question/answer patterns
-            if not should_change_speaker:
-                if (prev_text.endswith('?') or 
-                    any(word in prev_text.split()[:3] for word in question_words)):
-                    if gap > 0.2 and time_since_change > 1.0:  # Very sensitive
-                        should_change_speaker = True
-                        reason = "Question/answer pattern"
-            
-            # Rule 6: Very short responses
-            if not should_change_speaker and duration < 2.0:
-                if (len(words) <= 3 and 
-                    text.strip() in ['yeah.', 'yes.', 'yeah', 'yes', 'well.', 'oh.', 'right.', 'perf.', 'perf']):
-                    if time_since_change > 2.0 and gap > 0.2:  # More sensitive
-                        should_change_speaker = True
-                        reason = f"Very short response: '{text.strip()}'"
-            
-            # Rule 7: Name mentions
-            if not should_change_speaker:
-                if any(name in text for name in ['scott', 'wes', 'west']):
-                    if time_since_change > 1.0:  # More sensitive
-                        should_change_speaker = True
-                        reason = "Name mention"
-            
-            # Rule 8: Significant gaps with substantial previous content
-            if not should_change_speaker and gap > 0.8:
-                prev_duration = prev_segment["end"] - prev_segment["start"]
-                if prev_duration > 2.0 and time_since_change > 3.0:  # More sensitive
-                    should_change_speaker = True
-                    reason = f"Long gap: {gap:.2f}s after substantial content"
-        
-        # Apply speaker change
-        if should_change_speaker:
-            current_speaker = 2 if current_speaker == 1 else 1
-            last_change_time = start_time
-            print(f"Speaker change at {start_time:.2f}s: {reason}", file=sys.stderr)
-        
-        enhanced_segment = segment.copy()
-        enhanced_segment["speaker_id"] = f"Speaker_{current_speaker}"
-        enhanced_segments.append(enhanced_segment)
+        best_overlap = 0.0
+        k = j
+        while k < num_turns and turns[k][0] < end_time:
+            turn_start, turn_end, speaker = turns[k]
+            overlap_duration = min(end_time, turn_end) - max(start_time, turn_start)
+            if overlap_duration > best_overlap:
+                best_overlap = overlap_duration
+                speakers[idx] = speaker
+            k += 1
     
-    return enhanced_segments
+    return speakers
 
-def combine_consecutive_segments(segments):
+def combine_consecutive_segments(segments, language="unknown"):
     """
-    Combine consecutive segments from the same speaker into longer, more natural segments
+    Convert detected segments to the output format, combining consecutive segments
+    from the same speaker into longer, more natural segments in the same pass
     
     Args:
-        segments: List of segments with speaker assignments
+        segments: List of Whisper segments with speaker assignments
+        language: Detected language stored on every output segment
     
     Returns:
         List of combined segments with consecutive same-speaker segments merged
     """
-    if not segments:
-        return []
-    
     combined_segments = []
     current_segment = None
+    text_parts = []
+    confidence_sum = 0.0
+    merged_count = 0
     
     for segment in segments:
-        if current_segment is None:
-            # First segment
-            current_segment = segment.copy()
-        elif current_segment["speaker_id"] == segment["speaker_id"]:
-            # Same speaker, combine with current segment
-            # Extend the end time
-            current_segment["end_time"] = segment["end_time"]
-            # Combine the text with a space
-            current_segment["text"] = current_segment["text"].rstrip() + " " + segment["text"].strip()
-            # Keep the average confidence or use the first one
-            current_segment["confidence"] = (current_segment["confidence"] + segment["confidence"]) / 2
-        else:
-            # Different speaker, save current and start new
+        text = segment["text"].strip()
+        confidence = segment.get("confidence", 0.8)
+        
+        if current_segment is not None and current_segment["speaker_id"] == segment["speaker_id"]:
+            # Same speaker, extend the end time and collect the text
+            current_segment["end_time"] = segment["end"]
+            if text:
+                text_parts.append(text)
+            confidence_sum += confidence
+            merged_count += 1
+            continue
+        
+        # Different speaker, save current and start new
+        if current_segment is not None:
+            current_segment["text"] = " ".join(text_parts)
+            current_segment["confidence"] = confidence_sum / merged_count
             combined_segments.append(current_segment)
-            current_segment = segment.copy()
+        
+        current_segment = {
+            "start_time": segment["start"],
+            "end_time": segment["end"],
+            "speaker_id": segment["speaker_id"],
+            "text": text,
+            "confidence": confidence,
+            "language": language
+        }
+        text_parts = [text] if text else []
+        confidence_sum = confidence
+        merged_count = 1
     
     # Don't forget the last segment
     if current_segment is not None:
+        current_segment["text"] = " ".join(text_parts)
+        current_segment["confidence"] = confidence_sum / merged_count
         combined_segments.append(current_segment)
     
     return combined_segments
 
+def _to_float32(output):
+    """Cast floating point tensors in a (possibly nested tuple) model output back to float32"""
+    import torch
+    
+    if torch.is_tensor(output):
+        return output.float() if output.is_floating_point() else output
+    if isinstance(output, tuple):
+        return tuple(_to_float32(item) for item in output)
+    return output
+
+@contextlib.contextmanager
+def embedding_autocast(pipeline):
+    """
+    Run only the speaker embedding network of a diarization pipeline under float16 autocast
+    
+    Segmentation and feature extraction stay in float32: WeSpeaker models
+    compute fbank features from the waveform scaled by 2^15 inside their
+    forward pass, so only the ResNet that consumes those features is wrapped.
+    Pipelines without a recognizable embedding network run unchanged.
+    
+    Args:
+        pipeline: Loaded PyAnnote speaker diarization pipeline
+    """
+    import torch
+    
+    model = getattr(getattr(pipeline, "_embedding", None), "model_", None)
+    network = getattr(model, "resnet", model)
+    if not isinstance(network, torch.nn.Module):
+        yield
+        return
+    
+    forward = network.forward
+    
+    def half_forward(*args, **kwargs):
+        with torch.autocast("cuda", dtype=torch.float16):
+            output = forward(*args, **kwargs)
+        # Hand clustering the same float32 embeddings it gets without autocast
+        return _to_float32(output)
+    
+    network.forward = half_forward
+    try:
+        yield
+    finally:
+        del network.forward
+
+def diarize_audio(audio_file, pyannote_model, hf_token, max_speakers=None, min_speakers=None, fp16=None):
+    """
+    Run PyAnnote speaker diarization (or VAD only for a single speaker)
+    
+    Args:
+        audio_file: Path to audio file
+        pyannote_model: PyAnnote model ID from HuggingFace
+        hf_token: HuggingFace token for accessing PyAnnote models
+        max_speakers: Maximum number of speakers
+        min_speakers: Minimum number of speakers
+        fp16: Run the speaker embedding network under float16 autocast (default: on when running on CUDA)
+    
+    Returns:
+        List of (start, end, speaker) turns sorted by start time
+    """
+    import torch
+    
+    device = torch.device(get_default_device())
+    
+    # Decode once and hand PyAnnote the waveform instead of the file path
+    try:
+        audio_input = load_waveform(audio_file, pin_memory=device.type == "cuda")
+    except Exception as e:
+        print(f"Could not preload audio ({e}), PyAnnote will read the file", file=sys.stderr)
+        audio_input = audio_file
+    
+    # Half precision speeds up the embedding network on GPUs; see embedding_autocast
+    use_fp16 = device.type == "cuda" and fp16 is not False
+    
+    with PYANNOTE_LOCK:
+        if max_speakers == 1:
+            # Single speaker: voice activity detection is enough, skip the
+            # speaker embedding and clustering stages entirely
+            print(f"Loading PyAnnote model: {VAD_MODEL} (single speaker)", file=sys.stderr)
+            pipeline = load_pyannote_pipeline(VAD_MODEL, hf_token, device)
+            
+            print(f"Performing voice activity detection on {device.type}...", file=sys.stderr)
+            speech = pipeline(audio_input)
+            diarization = speech.rename_labels({label: "SPEAKER_00" for label in speech.labels()})
+        else:
+            print(f"Loading PyAnnote model: {pyannote_model}", file=sys.stderr)
+            pipeline = load_pyannote_pipeline(pyannote_model, hf_token, device)
+            
+            # Set speaker constraints if provided
+            kwargs = {}
+            if min_speakers is not None:
+                kwargs['min_speakers'] = min_speakers
+            if max_speakers is not None:
+                kwargs['max_speakers'] = max_speakers
+            
+            print(f"Performing speaker diarization on {device.type}...", file=sys.stderr)
+            precision = embedding_autocast(pipeline) if use_fp16 else contextlib.nullcontext()
+            with precision:
+                diarization = pipeline(audio_input, **kwargs)
+    
+    return sorted(
+        ((turn.start, turn.end, speaker) for turn, _, speaker in diarization.itertracks(yield_label=True)),
+        key=lambda t: t[0]
+    )
+
 def process_audio(audio_file, whisper_model="base", pyannote_model="pyannote/speaker-diarization-3.1", 
-                 hf_token=None, max_speakers=None, min_speakers=None):
+                 hf_token=None, max_speakers=None, min_speakers=None, batch_size=None,
+                 num_workers=1, fp16=None, mode="both"):
     """
     Process audio file with Whisper + PyAnnote
     
@@ -397,72 +912,105 @@ def process_audio(audio_file, whisper_model="base", pyannote_model="pyannote/spe
         hf_token: HuggingFace token for accessing PyAnnote models
         max_speakers: Maximum number of speakers
         min_speakers: Minimum number of speakers
+        batch_size: Batch size for faster-whisper batched transcription
+        num_workers: Number of threads sharing the Whisper model (see process_batch)
+        fp16: Run the speaker embedding network under float16 autocast (default: on when running on CUDA)
+        mode: "both", "transcribe" (Whisper only, single speaker) or
+              "diarize" (PyAnnote only, segments without text)
     
     Returns:
         Dictionary with segments containing speaker labels and transcripts
     """
-    import whisper
+    if mode not in PROCESSING_MODES:
+        raise ValueError(f"Unknown mode: {mode}")
+    
+    if mode == "diarize":
+        if not hf_token:
+            raise ValueError("Diarization mode requires a HuggingFace token")
+        
+        turns = diarize_audio(audio_file, pyannote_model, hf_token,
+                              max_speakers=max_speakers, min_speakers=min_speakers, fp16=fp16)
+        segments = [
+            {
+                "start_time": start,
+                "end_time": end,
+                "speaker_id": f"Speaker_{speaker}",
+                "text": "",
+                "confidence": 0.8,
+                "language": "unknown"
+            }
+            for start, end, speaker in turns
+        ]
+        num_speakers = len(set(speaker for _, _, speaker in turns))
+        print(f"Final result: {len(segments)} segments with {num_speakers} speakers", file=sys.stderr)
+        
+        return {
+            "segments": segments,
+            "total_duration": max((end for _, end, _ in turns), default=0.0),
+            "language": "unknown",
+            "diarization_used": True,
+            "num_speakers": num_speakers
+        }
     
     # Load Whisper model
     print(f"Loading Whisper model: {whisper_model}", file=sys.stderr)
-    whisper_model_obj = whisper.load_model(whisper_model)
+    backend, whisper_model_obj = load_whisper_model(whisper_model, num_workers=num_workers)
+    print(f"Using Whisper backend: {backend}", file=sys.stderr)
     
     # Transcribe with timestamps
     print("Transcribing audio...", file=sys.stderr)
-    result = whisper_model_obj.transcribe(audio_file, word_timestamps=True)
+    result = transcribe_audio(backend, whisper_model_obj, audio_file, batch_size=batch_size)
+    language = result.get("language", "unknown")
+    
+    if mode == "transcribe":
+        segments = [
+            {
+                "start_time": segment["start"],
+                "end_time": segment["end"],
+                "speaker_id": "Speaker_1",
+                "text": segment["text"].strip(),
+                "confidence": segment.get("confidence", 0.8),
+                "language": language
+            }
+            for segment in result["segments"]
+        ]
+        print(f"Final result: {len(segments)} segments (transcription only)", file=sys.stderr)
+        
+        return {
+            "segments": segments,
+            "total_duration": result.get("duration", 0.0),
+            "language": language,
+            "diarization_used": False,
+            "num_speakers": 1 if segments else 0
+        }
     
     # Attempt PyAnnote diarization
     segments = []
+    speakers = set()
     diarization_success = False
     
     if hf_token:
         try:
-            from pyannote.audio import Pipeline
-            
-            print(f"Loading PyAnnote model: {pyannote_model}", file=sys.stderr)
-            pipeline = Pipeline.from_pretrained(
-                pyannote_model,
-                use_auth_token=hf_token
-            )
-            
-            # Set speaker constraints if provided
-            kwargs = {}
-            if min_speakers is not None:
-                kwargs['min_speakers'] = min_speakers
-            if max_speakers is not None:
-                kwargs['max_speakers'] = max_speakers
-            
-            print("Performing speaker diarization...", file=sys.stderr)
-            diarization = pipeline(audio_file, **kwargs)
+            turns = diarize_audio(audio_file, pyannote_model, hf_token,
+                                  max_speakers=max_speakers, min_speakers=min_speakers, fp16=fp16)
             
             # Combine transcription and diarization
-            for segment in result["segments"]:
-                start_time = segment["start"]
-                end_time = segment["end"]
-                text = segment["text"]
-                
-                # Find speaker for this time segment
-                speaker_id = "Unknown"
-                best_overlap = 0.0
-                
-                for turn, _, speaker in diarization.itertracks(yield_label=True):
-                    overlap_start = max(start_time, turn.start)
-                    overlap_end = min(end_time, turn.end)
-                    
-                    if overlap_start < overlap_end:
-                        overlap_duration = overlap_end - overlap_start
-                        if overlap_duration > best_overlap:
-                            best_overlap = overlap_duration
-                            speaker_id = f"Speaker_{speaker}"
+            turn_speakers = assign_speakers_by_overlap(result["segments"], turns)
+            speakers = set()
+            segments = [None] * len(result["segments"])
+            
+            for i, (segment, speaker) in enumerate(zip(result["segments"], turn_speakers)):
+                speaker_id = f"Speaker_{speaker}" if speaker is not None else "Unknown"
+                speakers.add(speaker_id)
                 
-                segments.append({
-                    "start_time": start_time,
-                    "end_time": end_time,
+                segments[i] = {
+                    "start_time": segment["start"],
+                    "end_time": segment["end"],
                     "speaker_id": speaker_id,
-                    "text": text.strip(),
+                    "text": segment["text"].strip(),
                     "confidence": segment.get("confidence", 0.8),
-                    "language": result.get("language", "unknown")
-                })
+                    "language": language
+                }
             
             diarization_success = True
             print(f"Diarization successful: {len(segments)} segments with speakers", file=sys.stderr)
@@ -478,50 +1026,152 @@ def process_audio(audio_file, whisper_model="base", pyannote_model="pyannote/spe
         print("Using balanced speaker change detection for natural conversations...", file=sys.stderr)
         
         # Try balanced detection first (best for natural conversations)
-        enhanced_segments = balanced_speaker_detection(result["segments"])
+        enhanced_segments, speakers = balanced_speaker_detection(result["segments"])
         
         # Check if balanced detection found multiple speakers
-        speaker_count = len(set(seg["speaker_id"] for seg in enhanced_segments))
-        
-        if speaker_count == 1:
+        if len(speakers) == 1:
             print("Balanced detection found only 1 speaker, trying advanced detection...", file=sys.stderr)
-            enhanced_segments = advanced_speaker_change_detection(result["segments"])
-            speaker_count = len(set(seg["speaker_id"] for seg in enhanced_segments))
+            enhanced_segments, speakers = advanced_speaker_change_detection(result["segments"])
         
-        if speaker_count == 1:
+        if len(speakers) == 1:
             print("Advanced detection found only 1 speaker, trying simple detection...", file=sys.stderr)
-            enhanced_segments = simple_speaker_change_detection(result["segments"])
-        
-        # Convert to final format
-        for segment in enhanced_segments:
-            segments.append({
-                "start_time": segment["start"],
-                "end_time": segment["end"],
-                "speaker_id": segment["speaker_id"],
-                "text": segment["text"].strip(),
-                "confidence": segment.get("confidence", 0.8),
-                "language": result.get("language", "unknown")
-            })
+            enhanced_segments, speakers = simple_speaker_change_detection(result["segments"])
         
-        # Combine consecutive segments from the same speaker
-        print(f"Before combining: {len(segments)} segments", file=sys.stderr)
-        segments = combine_consecutive_segments(segments)
+        # Convert to final format, combining consecutive segments from the same speaker
+        print(f"Before combining: {len(enhanced_segments)} segments", file=sys.stderr)
+        segments = combine_consecutive_segments(enhanced_segments, language)
         print(f"After combining: {len(segments)} segments", file=sys.stderr)
     
-    final_speaker_count = len(set(seg["speaker_id"] for seg in segments))
+    final_speaker_count = len(speakers)
     print(f"Final result: {len(segments)} segments with {final_speaker_count} speakers", file=sys.stderr)
     
     return {
         "segments": segments,
         "total_duration": result.get("duration", 0.0),
-        "language": result.get("language", "unknown"),
+        "language": language,
         "diarization_used": diarization_success,
         "num_speakers": final_speaker_count
     }
 
+@functools.lru_cache(maxsize=None)
+def load_dotenv_token():
+    """
+    Find HUGGINGFACE_HUB_TOKEN in a .env file in the current or parent directories
+    
+    The files are parsed once per process. python-dotenv, when installed, is used
+    as a fallback for entries the simple "KEY=value" scan does not recognise.
+    
+    Returns:
+        Token string, or None if no .env file defines it
+    """
+    try:
+        from dotenv import dotenv_values
+    except ImportError:
+        dotenv_values = None
+    
+    for env_path in DOTENV_PATHS:
+        if not os.path.exists(env_path):
+            continue
+        
+        try:
+            with open(env_path, 'r') as f:
+                token = next(
+                    (line.split("=", 1)[1].strip().strip('"\'') for line in f
+                     if line.startswith("HUGGINGFACE_HUB_TOKEN=")),
+                    None
+                )
+            if not token and dotenv_values is not None:
+                token = dotenv_values(env_path).get("HUGGINGFACE_HUB_TOKEN")
+        except Exception:
+            continue
+        
+        if token:
+            return token
+    
+    return None
+
+def serve(defaults):
+    """
+    Process audio files requested over stdin, keeping models loaded between requests
+    
+    Each input line is a JSON object {"audio_file": ..., "options": {...}} where
+    options are process_audio keyword arguments overriding the CLI defaults. One
+    JSON result (or {"error": ...}) is written per line, echoing any request "id".
+    
+    Args:
+        defaults: Default process_audio keyword arguments from the command line
+    """
+    print("Serving requests on stdin", file=sys.stderr)
+    
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        
+        request = {}
+        try:
+            request = json.loads(line)
+            audio_file = request["audio_file"]
+            options = request.get("options", {})
+            
+            unknown = set(options) - SERVE_OPTIONS
+            if unknown:
+                raise ValueError(f"Unknown options: {', '.join(sorted(unknown))}")
+            if not os.path.exists(audio_file):
+                raise FileNotFoundError(f"Audio file not found: {audio_file}")
+            
+            response = process_audio(audio_file, **{**defaults, **options})
+        except Exception as e:
+            response = {"error": f"Processing failed: {str(e)}"}
+        
+        if isinstance(request, dict) and "id" in request:
+            response["id"] = request["id"]
+        
+        sys.stdout.write(dumps(response) + "\n")
+        sys.stdout.flush()
+    
+    # End of session: release models and cached GPU memory
+    WHISPER_MODEL_CACHE.clear()
+    PYANNOTE_PIPELINE_CACHE.clear()
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except ImportError:
+        pass
+
+def process_batch(audio_files, defaults, jobs):
+    """
+    Process several audio files concurrently, sharing one set of loaded models
+    
+    Transcription runs in parallel on a thread pool (faster-whisper models are
+    thread-safe); PyAnnote diarization is serialized. One JSON result per file
+    is written to stdout in input order, tagged with its "audio_file".
+    
+    Args:
+        audio_files: List of audio file paths
+        defaults: process_audio keyword arguments from the command line
+        jobs: Number of files processed concurrently
+    """
+    def process_one(audio_file):
+        try:
+            if not os.path.exists(audio_file):
+                raise FileNotFoundError(f"Audio file not found: {audio_file}")
+            response = process_audio(audio_file, num_workers=jobs, **defaults)
+        except Exception as e:
+            response = {"error": f"Processing failed: {str(e)}"}
+        
+        response["audio_file"] = audio_file
+        return response
+    
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for response in executor.map(process_one, audio_files):
+            sys.stdout.write(dumps(response) + "\n")
+            sys.stdout.flush()
+
 def main():
     parser = argparse.ArgumentParser(description="Whisper + PyAnnote Audio Processing")
-    parser.add_argument("audio_file", help="Path to audio file")
+    parser.add_argument("audio_file", nargs="?", help="Path to audio file")
     parser.add_argument("--whisper-model", default="base", 
                        choices=["tiny", "base", "small", "medium", "large"],
                        help="Whisper model size")
@@ -530,11 +1180,28 @@ def main():
     parser.add_argument("--hf-token", help="HuggingFace token")
     parser.add_argument("--max-speakers", type=int, help="Maximum number of speakers")
     parser.add_argument("--min-speakers", type=int, help="Minimum number of speakers")
+    parser.add_argument("--batch-size", type=int,
+                       help="Batch size for faster-whisper transcription (default: 16 on CUDA, 4 on CPU)")
+    parser.add_argument("--fp16", action=argparse.BooleanOptionalAction, default=None,
+                       help="Run the PyAnnote speaker embedding network in float16 (default: on when CUDA is available)")
+    parser.add_argument("--mode", default="both", choices=PROCESSING_MODES,
+                       help="Run transcription and diarization, or only one of them")
     parser.add_argument("--check-deps", action="store_true", 
                        help="Check if dependencies are installed")
+    parser.add_argument("--serve", action="store_true",
+                       help="Read JSON requests from stdin and keep models loaded between files")
+    parser.add_argument("--inputs",
+                       help="File listing audio files to process concurrently, one path per line")
+    parser.add_argument("--jobs", type=int, default=2,
+                       help="Number of files processed concurrently with --inputs")
     
     args = parser.parse_args()
     
+    if not args.audio_file and not (args.check_deps or args.serve or args.inputs):
+        parser.error("audio_file is required unless --check-deps, --serve or --inputs is used")
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    
     if args.check_deps:
         success, missing = check_dependencies()
         if success:
@@ -547,10 +1214,8 @@ def main():
             }))
         return
     
-    # Check dependencies before processing
-    success, missing = check_dependencies()
-    if not success:
-        # Check if at least Whisper is available for transcription-only
+    # Whisper is required unless only diarization was requested
+    if args.mode != "diarize":
         whisper_ok, whisper_missing = check_whisper_only()
         if not whisper_ok:
             print(json.dumps({
@@ -558,42 +1223,61 @@ def main():
                 "missing_packages": whisper_missing
             }))
             sys.exit(1)
-        else:
-            print(f"Warning: Some packages missing ({', '.join(missing)}), using enhanced Whisper-based speaker detection", file=sys.stderr)
     
     # Get HuggingFace token from environment if not provided
     hf_token = args.hf_token or os.getenv("HUGGINGFACE_HUB_TOKEN") or os.getenv("HF_TOKEN")
     
     # Also check for .env file in parent directories
     if not hf_token:
-        env_paths = [".env", "../.env", "../../.env"]
-        for env_path in env_paths:
-            if os.path.exists(env_path):
-                try:
-                    with open(env_path, 'r') as f:
-                        for line in f:
-                            if line.startswith("HUGGINGFACE_HUB_TOKEN="):
-                                hf_token = line.split("=", 1)[1].strip().strip('"\'')
-                                break
-                    if hf_token:
-                        break
-                except Exception:
-                    pass
+        hf_token = load_dotenv_token()
+    
+    # PyAnnote is only needed when diarization is possible
+    if args.mode == "diarize":
+        diarization_ok, missing = check_diarization_dependencies()
+        if not diarization_ok:
+            print(json.dumps({
+                "error": f"Missing required packages: {', '.join(missing)}",
+                "missing_packages": missing
+            }))
+            sys.exit(1)
+    elif hf_token and args.mode == "both":
+        diarization_ok, missing = check_diarization_dependencies()
+        if not diarization_ok:
+            print(f"Warning: Some packages missing ({', '.join(missing)}), using enhanced Whisper-based speaker detection", file=sys.stderr)
+    
+    options = {
+        "whisper_model": args.whisper_model,
+        "pyannote_model": args.pyannote_model,
+        "hf_token": hf_token,
+        "max_speakers": args.max_speakers,
+        "min_speakers": args.min_speakers,
+        "batch_size": args.batch_size,
+        "fp16": args.fp16,
+        "mode": args.mode
+    }
+    
+    if args.serve:
+        serve(options)
+        return
+    
+    if args.inputs:
+        try:
+            with open(args.inputs, 'r') as f:
+                audio_files = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+        except OSError as e:
+            print(json.dumps({"error": f"Could not read inputs file: {e}"}))
+            sys.exit(1)
+        
+        process_batch(audio_files, options, args.jobs)
+        return
     
     if not os.path.exists(args.audio_file):
         print(json.dumps({"error": f"Audio file not found: {args.audio_file}"}))
         sys.exit(1)
     
     try:
-        result = process_audio(
-            args.audio_file,
-            whisper_model=args.whisper_model,
-            pyannote_model=args.pyannote_model,
-            hf_token=hf_token,
-            max_speakers=args.max_speakers,
-            min_speakers=args.min_speakers
-        )
-        print(json.dumps(result))
+        result = process_audio(args.audio_file, **options)
+        print(dumps(result))
     except Exception as e:
         print(json.dumps({"error": f"Processing failed: {str(e)}"}))
         sys.exit(1)
@@ -5,165 +5,244 @@ Tests different speaker detection algorithms and shows detailed analysis
 """
 
 import sys
+import io
+import re
 import json
 import argparse
+import functools
 import warnings
 from pathlib import Path
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Suppress warnings
 warnings.filterwarnings("ignore")
 
+def _compile_phrases(phrases):
+    """Compile phrases into a single regex that matches any of them as a substring"""
+    return re.compile('|'.join(re.escape(p) for p in sorted(phrases, key=len, reverse=True)))
+
+def _trunc(s, n=60):
+    """Split text into its first n characters and an ellipsis if it was cut"""
+    return s[:n], '...' if len(s) > n else ''
+
+# Known patterns from the test file
+_CLEAR_SPEAKER_CHANGES = (
+    "into the weeds",
+    "yeah. perf",
+    "well, i use typescript and i have bugs",
+    "by the way, speaking of really good",
+    "all right. enough of that",
+    "you want to go first",
+    "a string literal type is a"
+)
+
+_INTERJECTIONS = frozenset({
+    'yeah', 'yes', 'well', 'oh', 'right', 'exactly', 'true', 'sure',
+    'okay', 'ok', 'alright', 'all right', 'perfect', 'great', 'nice'
+})
+
+# Interjection followed by a space or a full stop; an exact match is
+# checked separately so "ok" does not match "okra"
+_INTERJECTION_PREFIXES = (tuple(w + ' ' for w in _INTERJECTIONS) +
+                          tuple(w + '.' for w in _INTERJECTIONS))
+
+_TOPIC_TRANSITIONS = ("by the way", "speaking of", "all right", "enough of that")
+
+_CLEAR_RE = _compile_phrases(_CLEAR_SPEAKER_CHANGES)
+_TRANSITION_RE = _compile_phrases(_TOPIC_TRANSITIONS)
+
+# Expected diarization line: "[Speaker N] text"
+_SPEAKER_LINE_RE = re.compile(r'^\[(Speaker [^\]]*)\]\s*(.*)$')
+
 def load_expected_diarization(test_file):
     """Load expected diarization from test file"""
     expected_segments = []
     
+    # Parse expected segments line by line, without reading the whole file
     with open(test_file, 'r') as f:
-        content = f.read()
-    
-    # Parse expected segments
-    lines = content.strip().split('\n')
-    current_speaker = None
-    current_text = []
-    
-    for line in lines:
-        line = line.strip()
-        if line.startswith('[Speaker '):
-            # Extract speaker and text
-            if ']' in line:
-                speaker_part = line.split(']')[0] + ']'
-                text_part = line.split(']', 1)[1].strip()
-                
-                speaker_id = speaker_part.replace('[', '').replace(']', '')
-                
+        for raw_line in f:
+            # Extract speaker and text from "[Speaker N] text"
+            match = _SPEAKER_LINE_RE.match(raw_line.strip())
+            if match:
                 expected_segments.append({
-                    'speaker_id': speaker_id,
-                    'text': text_part,
+                    'speaker_id': match.group(1),
+                    'text': match.group(2).strip(),
                     'expected': True
                 })
     
     return expected_segments
 
-def debug_whisper_segments(segments):
+def debug_whisper_segments(segments, verbose=True):
     """Debug Whisper segments to understand the input"""
-    print("\n🔍 WHISPER SEGMENTS DEBUG:")
-    print("=" * 50)
+    if not verbose:
+        return
     
+    # Buffer the report and write it once instead of printing per segment
+    buf = io.StringIO()
+    buf.write("\n🔍 WHISPER SEGMENTS DEBUG:\n" + "=" * 50 + "\n")
+    
+    prev_end = None
     for i, segment in enumerate(segments):
-        duration = segment['end'] - segment['start']
-        gap = 0.0
-        if i > 0:
-            gap = segment['start'] - segments[i-1]['end']
+        start, end = segment['start'], segment['end']
+        gap = start - prev_end if prev_end is not None else 0.0
+        prev_end = end
         
-        print(f"[{i+1:2d}] {segment['start']:6.2f}s-{segment['end']:6.2f}s "
-              f"({duration:5.2f}s) gap:{gap:5.2f}s")
-        print(f"     Text: '{segment['text'].strip()}'")
-        print()
+        buf.write(f"[{i+1:2d}] {start:6.2f}s-{end:6.2f}s ({end - start:5.2f}s) gap:{gap:5.2f}s\n"
+                  f"     Text: '{segment['text'].strip()}'\n\n")
+    
+    sys.stdout.write(buf.getvalue())
 
-def enhanced_conversation_detection(segments):
-    """
-    Enhanced conversation detection specifically for the test case
+@functools.lru_cache(maxsize=128)
+def _detect_cached(key):
     """
-    if not segments:
-        return []
+    Run the speaker change rules over a hashable transcript
     
-    print("\n🎯 ENHANCED CONVERSATION DETECTION:")
-    print("=" * 50)
+    Args:
+        key: Tuple of (start, end, text) per segment
+        
+    Returns:
+        Tuple of (speaker number, change reason or None, gap) per segment
+    """
+    results = []
+    current_speaker = 1
     
-    # Known patterns from the test file
-    clear_speaker_changes = [
-        "into the weeds",
-        "yeah. perf",
-        "well, i use typescript and i have bugs",
-        "by the way, speaking of really good",
-        "all right. enough of that",
-        "you want to go first",
-        "a string literal type is a"
-    ]
-    
-    interjections = {
-        'yeah', 'yes', 'well', 'oh', 'right', 'exactly', 'true', 'sure',
-        'okay', 'ok', 'alright', 'all right', 'perfect', 'great', 'nice'
-    }
+    # Durations and gaps to the previous segment for the whole transcript
+    if np is not None:
+        starts = np.array([seg[0] for seg in key], dtype=np.float64)
+        ends = np.array([seg[1] for seg in key], dtype=np.float64)
+        durations = (ends - starts).tolist()
+        gaps = [0.0] + (starts[1:] - ends[:-1]).tolist()
+    else:
+        durations = [end - start for start, end, _ in key]
+        gaps = [0.0] + [key[i][0] - key[i - 1][1] for i in range(1, len(key))]
     
-    enhanced_segments = []
-    current_speaker = 1
+    texts_lower = [text.strip().lower() for _, _, text in key]
     
-    for i, segment in enumerate(segments):
-        should_change = False
-        reason = ""
-        
-        text = segment.get("text", "").strip().lower()
-        duration = segment["end"] - segment["start"]
-        
-        # Previous segment info
-        gap = 0.0
-        if i > 0:
-            gap = segment["start"] - segments[i-1]["end"]
-        
-        # Rule 1: Clear speaker change phrases
-        for phrase in clear_speaker_changes:
-            if phrase in text:
-                should_change = True
-                reason = f"Clear phrase: '{phrase}'"
-                break
+    for i, text_lower in enumerate(texts_lower):
+        duration = durations[i]
+        gap = gaps[i]
         
-        # Rule 2: Short interjections after gaps
-        if not should_change and duration < 3.0:
-            words = text.split()
-            if words and words[0] in interjections:
-                if gap > 0.5:
-                    should_change = True
-                    reason = f"Short interjection: '{words[0]}' after {gap:.2f}s gap"
+        # Cheap numeric checks gate each rule before any string scanning
+        reason = None
         
-        # Rule 3: Contradictory statements
-        if not should_change and text.startswith("well"):
-            if i > 0 and gap > 0.3:
-                should_change = True
+        # Rule 1: Significant gaps (be more aggressive)
+        if gap > 1.0:
+            reason = f"Long gap: {gap:.2f}s"
+        else:
+            # Rule 2: Clear speaker change phrases
+            match = _CLEAR_RE.search(text_lower)
+            if match:
+                reason = f"Clear phrase: '{match.group(0)}'"
+            
+            # Rule 3: Short interjections after gaps
+            elif duration < 3.0 and gap > 0.5 and (
+                    text_lower in _INTERJECTIONS or text_lower.startswith(_INTERJECTION_PREFIXES)):
+                word = text_lower.partition(' ')[0].rstrip('.,!?')
+                reason = f"Short interjection: '{word}' after {gap:.2f}s gap"
+            
+            # Rule 4: Contradictory statements
+            elif i > 0 and gap > 0.3 and text_lower.startswith("well"):
                 reason = "Contradictory statement starting with 'well'"
+            
+            # Rule 5: Topic transitions
+            else:
+                match = _TRANSITION_RE.search(text_lower)
+                if match:
+                    reason = f"Topic transition: '{match.group(0)}'"
         
-        # Rule 4: Topic transitions
-        topic_transitions = ["by the way", "speaking of", "all right", "enough of that"]
-        if not should_change:
-            for transition in topic_transitions:
-                if transition in text:
-                    should_change = True
-                    reason = f"Topic transition: '{transition}'"
-                    break
-        
-        # Rule 5: Significant gaps (be more aggressive)
-        if not should_change and gap > 1.0:
-            should_change = True
-            reason = f"Long gap: {gap:.2f}s"
+        if reason is not None:
+            current_speaker ^= 3  # toggles 1 <-> 2
         
-        if should_change:
-            current_speaker = 2 if current_speaker == 1 else 1
-            print(f"🔄 Speaker change at segment {i+1}: {reason}")
+        results.append((current_speaker, reason, gap))
+    
+    return tuple(results)
+
+def enhanced_conversation_detection(segments, verbose=True):
+    """
+    Enhanced conversation detection specifically for the test case
+    
+    Results are memoized on (start, end, text), so repeated runs over the
+    same transcript skip the rule stack. With verbose=False the
+    per-segment report is not built at all.
+    
+    The input segments are not copied: each one gets its "speaker_id" set
+    in place and the same dicts are returned.
+    
+    Returns:
+        Tuple of (enhanced segments, set of speaker ids seen)
+    """
+    if not segments:
+        return [], set()
+    
+    key = tuple((seg["start"], seg["end"], seg.get("text", "")) for seg in segments)
+    detected = _detect_cached(key)
+    
+    # Buffer the report (change notices and rows, in order) and write it once
+    out = ["\n🎯 ENHANCED CONVERSATION DETECTION:", "=" * 50] if verbose else None
+    
+    enhanced_segments = []
+    seen = set()
+    
+    for i, (segment, (current_speaker, reason, gap)) in enumerate(zip(segments, detected)):
+        speaker_id = f"Speaker {current_speaker}"
+        segment["speaker_id"] = speaker_id
+        enhanced_segments.append(segment)
         
-        enhanced_segment = segment.copy()
-        enhanced_segment["speaker_id"] = f"Speaker {current_speaker}"
-        enhanced_segments.append(enhanced_segment)
+        # The speaker only changes on the first segment or a toggle
+        if i == 0 or reason is not None:
+            seen.add(speaker_id)
         
-        print(f"[{i+1:2d}] Speaker {current_speaker}: '{text[:50]}{'...' if len(text) > 50 else ''}'"
-              f" ({duration:.2f}s, gap:{gap:.2f}s)")
+        if verbose:
+            if reason is not None:
+                out.append(f"🔄 Speaker change at segment {i+1}: {reason}")
+            start, end, text = key[i]
+            text_lower = text.strip().lower()
+            t, tail = _trunc(text_lower, 50)
+            out.append(f"[{i+1:2d}] Speaker {current_speaker}: '{t}{tail}'"
+                       f" ({end - start:.2f}s, gap:{gap:.2f}s)")
     
-    return enhanced_segments
+    if verbose:
+        sys.stdout.write('\n'.join(out) + '\n')
+    
+    return enhanced_segments, seen
 
-def compare_with_expected(result_segments, expected_segments):
+def compare_with_expected(result_segments, expected_segments, verbose=True, seen_speakers=None):
     """Compare results with expected diarization"""
+    if not verbose:
+        # Only the verdict is needed, skip building the report
+        if seen_speakers is None:
+            seen_speakers = set(seg['speaker_id'] for seg in result_segments)
+        return len(seen_speakers) >= 2
+    
     print("\n📊 COMPARISON WITH EXPECTED:")
     print("=" * 50)
     
+    # Collect speakers while printing each list
+    exp_speakers = set()
+    act_speakers = set()
+    
     print("Expected segments:")
     for i, exp in enumerate(expected_segments):
-        print(f"[{i+1:2d}] {exp['speaker_id']}: '{exp['text'][:60]}{'...' if len(exp['text']) > 60 else ''}'")
+        speaker_id = exp['speaker_id']
+        exp_speakers.add(speaker_id)
+        t, tail = _trunc(exp['text'])
+        print(f"[{i+1:2d}] {speaker_id}: '{t}{tail}'")
     
     print("\nActual segments:")
     for i, seg in enumerate(result_segments):
-        print(f"[{i+1:2d}] {seg['speaker_id']}: '{seg['text'][:60]}{'...' if len(seg['text']) > 60 else ''}'")
-    
-    # Count speakers
-    exp_speakers = set(exp['speaker_id'] for exp in expected_segments)
-    act_speakers = set(seg['speaker_id'] for seg in result_segments)
+        speaker_id = seg['speaker_id']
+        act_speakers.add(speaker_id)
+        t, tail = _trunc(seg['text'])
+        print(f"[{i+1:2d}] {speaker_id}: '{t}{tail}'")
     
     print(f"\nExpected speakers: {len(exp_speakers)} ({', '.join(sorted(exp_speakers))})")
     print(f"Actual speakers: {len(act_speakers)} ({', '.join(sorted(act_speakers))})")
@@ -175,50 +254,95 @@ def compare_with_expected(result_segments, expected_segments):
     
     return len(act_speakers) >= 2
 
-def test_diarization_algorithm(audio_file, expected_file=None):
+def _dumps(obj):
+    """Serialize to indented JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode()
+
+def export_results(path, segments):
+    """Write the detected speaker segments to a JSON file"""
+    records = [{"start": seg["start"], "end": seg["end"], "speaker_id": seg["speaker_id"],
+                "text": seg.get("text", "").strip()} for seg in segments]
+    Path(path).write_bytes(_dumps({"segments": records}))
+
+@functools.lru_cache(maxsize=4)
+def _get_whisper_model(name):
+    """Load a Whisper model once per name and reuse it across calls"""
+    import whisper
+    return whisper.load_model(name)
+
+@functools.lru_cache(maxsize=8)
+def _load_audio(path):
+    """Decode an audio file to a 16kHz waveform once and reuse it across calls"""
+    # ffmpeg reports a missing input as a generic decode failure, so open the
+    # file first: a bad path raises FileNotFoundError before whisper is imported
+    with open(path, "rb"):
+        pass
+    import whisper
+    return whisper.load_audio(path)
+
+def test_diarization_algorithm(audio_file, expected_file=None, verbose=True, export_file=None,
+                               word_timestamps=False):
     """Test different diarization algorithms"""
+    if verbose:
+        print(f"🎵 Loading audio file: {audio_file}")
+    
+    # Decode the audio before loading the model, so a bad path fails fast
     try:
-        import whisper
+        audio = _load_audio(audio_file)
     except ImportError:
         print("❌ Whisper not installed. Install with: pip install openai-whisper")
         return
     
-    print(f"🎵 Loading audio file: {audio_file}")
-    
     # Load Whisper model
-    model = whisper.load_model("base")
+    model = _get_whisper_model("base")
     
     # Transcribe
-    print("🔄 Transcribing with Whisper...")
-    result = model.transcribe(audio_file, word_timestamps=True)
+    if verbose:
+        print("🔄 Transcribing with Whisper...")
+    # The detector only reads segment start/end/text, so the word alignment
+    # pass is opt-in; fp16 is only usable on GPU
+    result = model.transcribe(audio, fp16=model.device.type == "cuda",
+                              word_timestamps=word_timestamps)
     
     segments = result["segments"]
-    print(f"✅ Transcribed {len(segments)} segments")
+    if verbose:
+        print(f"✅ Transcribed {len(segments)} segments")
     
     # Debug original segments
-    debug_whisper_segments(segments)
+    debug_whisper_segments(segments, verbose=verbose)
     
     # Load expected results if available
     expected_segments = []
     if expected_file and Path(expected_file).exists():
         expected_segments = load_expected_diarization(expected_file)
-        print(f"📋 Loaded {len(expected_segments)} expected segments")
+        if verbose:
+            print(f"📋 Loaded {len(expected_segments)} expected segments")
     
     # Test enhanced conversation detection
-    enhanced_result = enhanced_conversation_detection(segments)
+    enhanced_result, speakers = enhanced_conversation_detection(segments, verbose=verbose)
+    
+    if export_file:
+        export_results(export_file, enhanced_result)
+        if verbose:
+            print(f"💾 Exported {len(enhanced_result)} segments to {export_file}")
     
     # Compare results
     if expected_segments:
-        success = compare_with_expected(enhanced_result, expected_segments)
+        success = compare_with_expected(enhanced_result, expected_segments, verbose=verbose,
+                                        seen_speakers=speakers)
         return success
+    elif not verbose:
+        return len(speakers) >= 2
     else:
         # Just show the results
         print("\n🎯 ENHANCED RESULTS:")
         print("=" * 30)
         for i, seg in enumerate(enhanced_result):
-            print(f"[{i+1:2d}] {seg['speaker_id']}: '{seg['text'][:60]}{'...' if len(seg['text']) > 60 else ''}'")
+            t, tail = _trunc(seg['text'])
+            print(f"[{i+1:2d}] {seg['speaker_id']}: '{t}{tail}'")
         
-        speakers = set(seg['speaker_id'] for seg in enhanced_result)
         print(f"\nDetected {len(speakers)} speakers: {', '.join(sorted(speakers))}")
         return len(speakers) >= 2
 
@@ -227,26 +351,38 @@ def main():
     parser.add_argument("audio_file", help="Path to audio file")
     parser.add_argument("--expected", help="Path to expected diarization file")
     parser.add_argument("--export", help="Export results to JSON file")
+    parser.add_argument("--word-timestamps", action="store_true",
+                       help="Ask Whisper for word-level timestamps (slower)")
+    parser.add_argument("--quiet", action="store_true",
+                       help="Only print the final verdict, skip the debug report")
     
     args = parser.parse_args()
     
-    if not Path(args.audio_file).exists():
-        print(f"❌ Audio file not found: {args.audio_file}")
-        sys.exit(1)
-    
     try:
-        success = test_diarization_algorithm(args.audio_file, args.expected)
+        verbose = not args.quiet
+        success = test_diarization_algorithm(args.audio_file, args.expected, verbose=verbose,
+                                             export_file=args.export,
+                                             word_timestamps=args.word_timestamps)
         
         if success:
             print("\n✅ Diarization test PASSED - Multiple speakers detected")
         else:
             print("\n❌ Diarization test FAILED - Only one speaker detected")
+        
+        if not success and verbose:
             print("\n🔧 Debugging suggestions:")
             print("1. Check if there are clear speaker changes in the audio")
             print("2. Verify audio quality and speaker distinctiveness")
             print("3. Try adjusting detection thresholds")
             print("4. Consider using PyAnnote with HuggingFace token")
         
+    except FileNotFoundError as e:
+        if e.filename == args.audio_file:
+            print(f"❌ Audio file not found: {args.audio_file}")
+        else:
+            # e.g. the ffmpeg binary itself is missing
+            print(f"❌ Error: {e}")
+        sys.exit(1)
     except Exception as e:
         print(f"❌ Error: {e}")
         sys.exit(1)